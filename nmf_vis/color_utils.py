@@ -1,17 +1,17 @@
 from __future__ import annotations
-import json
 from pathlib import Path
-import plotly.express as px
 import plotly.colors as pc
 from typing import Dict
 
+from nmf_vis.io_utils import read_json
+
 
 def component_palette(n: int) -> list[str]:
     return pc.sample_colorscale("Viridis", [i / (n - 1) for i in range(n)])
 
 
 def distinct_palette(n: int) -> list[str]:
-    return px.colors.qualitative.Alphabet[:n]
+    return pc.qualitative.Alphabet[:n]
 
 
 def load_cancer_colors(json_path: str | Path | None) -> Dict[str, str]:
@@ -21,4 +21,4 @@ def load_cancer_colors(json_path: str | Path | None) -> Dict[str, str]:
     p = Path(json_path)
     if not p.exists():
         return {}
-    return json.loads(p.read_text())
+    return dict(read_json(p))
@@ -1,64 +1,140 @@
-import json
-import glob
-import re
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Final, List, Tuple, Dict
 
 import numpy as np
-import pandas as pd
+import polars as pl
+import polars.selectors as cs
 
-from nmf_vis.sort_utils import get_sample_order
+from nmf_vis.io_utils import cancer_codes, mtime_ns, read_json
+from nmf_vis.sort_utils import get_component_order, get_sample_order
 from nmf_vis.color_utils import load_cancer_colors, component_palette
 
 
-cache: Final[dict[Path, pd.DataFrame]] = {}
+DEFAULT_CSV_FILENAME: Final = "data/all_H_component_contributions.csv"
+
+# The only UMAP columns the scatter plot reads
+UMAP_COLUMNS: Final = ("Sample ID", "Cancer Type", "UMAP-1", "UMAP-2")
+
+# Bump whenever the parquet sidecar's schema changes so older files are rebuilt
+SIDECAR_FORMAT: Final = "1"
 
 
 def load_cfg(path: str | Path = "config.json") -> dict:
-    return json.load(open(path, "r"))
+    # The parsed file is cached and shared, so hand out a copy
+    return dict(read_json(path))
+
+
+def _read_dataframe(path: str, mtime: int, sample_id_column: str) -> pl.DataFrame:
+    """Read an H file, from its parquet sidecar when that is current."""
+    filepath = Path(path)
+
+    # A parquet sidecar written on first load skips CSV parsing on later runs
+    parquet_path = filepath.with_suffix(".parquet")
+    # Tie the sidecar to the exact CSV version it was built from; copies made
+    # with cp -p or rsync -t can swap in new data behind an older mtime
+    sidecar_tag = {
+        "nmf_vis_format": SIDECAR_FORMAT,
+        "sample_id_column": sample_id_column,
+        "source_mtime_ns": str(mtime),
+        "source_size": str(filepath.stat().st_size),
+    }
+    if _sidecar_is_current(parquet_path, sidecar_tag):
+        return pl.read_parquet(parquet_path)
+
+    # Project only the sample ID and numeric component columns at scan time,
+    # storing components as float32 to halve memory traffic downstream
+    df = (
+        pl.scan_csv(filepath)
+        .select(cs.by_name(sample_id_column) | cs.numeric())
+        .with_columns((cs.numeric() - cs.by_name(sample_id_column)).cast(pl.Float32))
+        .collect()
+    )
+    _write_sidecar(df, parquet_path, sidecar_tag)
+    return df
+
+
+def _sidecar_is_current(path: Path, tag: dict[str, str]) -> bool:
+    """Whether a sidecar exists and was written with exactly ``tag``."""
+    try:
+        metadata = pl.read_parquet_metadata(path)
+    except (OSError, pl.exceptions.ComputeError):
+        return False
+    return all(metadata.get(key) == value for key, value in tag.items())
 
 
-def _get_dataframe(filepath: Path) -> pd.DataFrame:
-    if filepath not in cache:
-        cache[filepath] = pd.read_csv(filepath)
-    return cache[filepath]
+def _write_sidecar(df: pl.DataFrame, path: Path, tag: dict[str, str]) -> None:
+    """Best-effort sidecar write; the data directory may well be read-only."""
+    # Write to a temporary file and rename it so that a failed write never
+    # leaves a truncated sidecar behind
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        df.write_parquet(tmp_path, metadata=tag)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=8)
+def _read_matrix(
+    path: str, mtime: int, sample_id_column: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Convert an H file to read-only numpy arrays once per file version."""
+    df = _read_dataframe(path, mtime, sample_id_column)
+
+    component_columns = [c for c in df.columns if c != sample_id_column]
+
+    if not component_columns:
+        raise ValueError(f"No numeric component columns found in {path}")
+
+    sample_ids = df[sample_id_column].to_numpy()
+    # polars hands back column-major data; every consumer walks H by sample row
+    H = np.ascontiguousarray(df.select(component_columns).to_numpy())
+    cancer_types = cancer_codes(sample_ids)
+
+    # Shared between callers, so guard against in-place edits
+    for arr in (H, sample_ids, cancer_types):
+        arr.flags.writeable = False
+    return H, sample_ids, cancer_types
 
 
 def _get_prepared_data(
     filepath: Path,
     sample_id_column: str = "sample_id",
     selection: list[int] | None = None,
-) -> Tuple[np.ndarray, List[str], List[str]]:
+) -> Tuple[np.ndarray, List[str], np.ndarray]:
     """
     Get H matrix, sample IDs, and cancer types, ready for visualization.
     """
 
-    df = _get_dataframe(filepath)
+    H, sample_ids, cancer_types = _read_matrix(
+        str(filepath), filepath.stat().st_mtime_ns, sample_id_column
+    )
 
     if selection is not None:
-        df = df.iloc[selection]
-
-    component_columns = [
-        c
-        for c in df.columns
-        if c != sample_id_column and pd.api.types.is_numeric_dtype(df[c])
-    ]
+        H = H[selection]
+        sample_ids = sample_ids[selection]
+        cancer_types = cancer_types[selection]
 
-    if not component_columns:
-        raise ValueError(f"No numeric component columns found in {filepath}")
+    return H, sample_ids.tolist(), cancer_types
 
-    sample_ids = df[sample_id_column].tolist()
-    H = df[component_columns].values
 
-    cancer_types = [i[:4] for i in sample_ids]
-
-    return H, sample_ids, cancer_types
+def get_prepared_data(
+    cfg_path: str | Path = "config.json",
+    selection: list[int] | None = None,
+) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """Get H matrix, sample IDs, and cancer types for the configured CSV."""
+    cfg = load_cfg(cfg_path)
+    return _get_prepared_data(
+        Path(cfg.get("DEFAULT_CSV_FILENAME", DEFAULT_CSV_FILENAME)),
+        selection=selection,
+    )
 
 
 def _load_component_colors(path, n_components, component_order):
     try:
-        with open(path, "r") as f:
-            return json.load(f)
+        return dict(read_json(path))
     except FileNotFoundError:
         return {
             f"Comp_{i}": color
@@ -66,23 +142,16 @@ def _load_component_colors(path, n_components, component_order):
         }
 
 
-def load_all_data(cfg_path, sort_method):
-    """Loads and prepares all data needed for the visualization."""
+@lru_cache(maxsize=8)
+def _load_invariant_data(cfg_path: str, mtimes: tuple[int, ...]) -> tuple:
+    """Load everything in load_all_data that does not depend on the sort method."""
     cfg = load_cfg(cfg_path)
-    H, sample_ids, cancer_types = _get_prepared_data(
-        Path(cfg.get("DEFAULT_CSV_FILENAME", "data/all_H_component_contributions.csv"))
-    )
+    H, sample_ids, cancer_types = get_prepared_data(cfg_path)
     n_samples, n_components = H.shape
 
-    component_order = np.argsort(-H.sum(axis=0))
-    H_ord = H[:, component_order]
-
-    sample_order = get_sample_order(sort_method, H, sample_ids, cancer_types, cfg_path)
-
-    H_sorted = H_ord[sample_order]
-    x_labels_short = np.array(
-        [label[:4] for label in np.array(sample_ids)[sample_order]]
-    )
+    component_order = get_component_order(H)
+    # Shared between callers, so guard against in-place edits
+    component_order.flags.writeable = False
 
     component_colors = _load_component_colors(
         cfg.get("JSON_FILENAME_COMPONENT_COLORS", "nmf_component_color_map.json"),
@@ -91,7 +160,82 @@ def load_all_data(cfg_path, sort_method):
     )
     cancer_color_map = load_cancer_colors(cfg.get("JSON_FILENAME_CANCER_TYPE_COLORS"))
 
-    umap_df = pd.read_parquet(cfg.get("UMAP_FILENAME"))
+    # Only the scatter plot needs pandas; the heatmap alone never imports it
+    import pandas as pd
+
+    umap_df = pd.read_parquet(cfg.get("UMAP_FILENAME"), columns=list(UMAP_COLUMNS))
+    # jscatter factorizes string columns it colors by; hand it the codes up front
+    umap_df["Cancer Type"] = umap_df["Cancer Type"].astype("category")
+
+    return (
+        H,
+        sample_ids,
+        cancer_types,
+        component_colors,
+        cancer_color_map,
+        component_order,
+        umap_df,
+    )
+
+
+@lru_cache(maxsize=8)
+def _load_sorted_data(
+    cfg_path: str, mtimes: tuple[int, ...], sort_method: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return H and the short labels reordered for ``sort_method``."""
+    H, sample_ids, cancer_types, _, _, component_order, _ = _load_invariant_data(
+        cfg_path, mtimes
+    )
+
+    sample_order = get_sample_order(
+        sort_method,
+        H,
+        sample_ids,
+        cancer_types,
+        cfg_path,
+        component_order=component_order,
+    )
+
+    # Reorder samples and components in a single gather
+    H_sorted = H[np.ix_(sample_order, component_order)]
+    x_labels_short = cancer_types[sample_order]
+
+    # Shared between callers, so guard against in-place edits
+    for arr in (H_sorted, x_labels_short):
+        arr.flags.writeable = False
+    return H_sorted, x_labels_short
+
+
+def input_mtimes(cfg_path: str | Path) -> tuple[int, ...]:
+    """Modification times of the config and every file it points the views at."""
+    cfg = load_cfg(cfg_path)
+    return tuple(
+        mtime_ns(p)
+        for p in (
+            cfg_path,
+            cfg.get("DEFAULT_CSV_FILENAME", DEFAULT_CSV_FILENAME),
+            cfg.get("JSON_FILENAME_COMPONENT_COLORS", "nmf_component_color_map.json"),
+            cfg.get("JSON_FILENAME_CANCER_TYPE_COLORS"),
+            cfg.get("JSON_FILENAME_ORGAN_SYSTEM", "tissue_source_tcga.json"),
+            cfg.get("JSON_FILENAME_EMBRYONIC_LAYER", "emb.json"),
+            cfg.get("UMAP_FILENAME"),
+        )
+    )
+
+
+def load_all_data(cfg_path, sort_method):
+    """Loads and prepares all data needed for the visualization."""
+    mtimes = input_mtimes(cfg_path)
+    (
+        H,
+        sample_ids,
+        cancer_types,
+        component_colors,
+        cancer_color_map,
+        component_order,
+        umap_df,
+    ) = _load_invariant_data(str(cfg_path), mtimes)
+    H_sorted, x_labels_short = _load_sorted_data(str(cfg_path), mtimes, sort_method)
 
     # These would be loaded similarly from the other JSON files
     organ_systems = []
@@ -99,12 +243,13 @@ def load_all_data(cfg_path, sort_method):
     embryonic_layers = []
     embryonic_layer_colors = {}
 
+    # Callers fill in missing colors and add columns, so hand out copies
     return (
         H,
-        sample_ids,
+        list(sample_ids),
         cancer_types,
-        component_colors,
-        cancer_color_map,
+        dict(component_colors),
+        dict(cancer_color_map),
         organ_systems,
         organ_system_colors,
         embryonic_layers,
@@ -112,5 +257,5 @@ def load_all_data(cfg_path, sort_method):
         H_sorted,
         x_labels_short,
         component_order,
-        umap_df,
+        umap_df.copy(deep=False),
     )
@@ -1,32 +1,87 @@
 from __future__ import annotations
 
-import json
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
 import plotly.graph_objects as go
-from plotly.graph_objs import FigureWidget
 from plotly.subplots import make_subplots
 
-from nmf_vis.data_utils import _get_prepared_data, load_cfg
-from nmf_vis.sort_utils import get_sample_order
+from nmf_vis.data_utils import get_prepared_data, input_mtimes, load_cfg
+from nmf_vis.io_utils import load_groupings, mtime_ns, read_json
+from nmf_vis.sort_utils import (
+    get_component_order,
+    get_sample_order,
+    winning_components,
+)
 from nmf_vis.color_utils import component_palette, distinct_palette, load_cancer_colors
 
 
 def create_heatmap(cfg_path="config.json", sort_method="component", sample_ids=None):
-    if sample_ids is None:
-        heatmap_widget = FigureWidget(create_heatmap_figure(cfg_path, sort_method))
-    else:
-        heatmap_widget = FigureWidget(
-            create_heatmap_figure(cfg_path, sort_method, selected_sample_ids=sample_ids)
+    return _heatmap_widget(
+        create_heatmap_figure(cfg_path, sort_method, selected_sample_ids=sample_ids),
+        sample_ids,
+    )
+
+
+def update_heatmap(
+    heatmap_widget: go.FigureWidget,
+    cfg_path="config.json",
+    sort_method="component",
+    sample_ids=None,
+) -> None:
+    """Redraw a heatmap widget in place for a new sort method or selection.
+
+    Every heatmap has the same traces, so they are patched rather than replaced
+    and the browser updates the plot instead of rebuilding it. If the figure
+    can't be built, the same widget shows an error placeholder instead.
+    """
+    try:
+        fig = create_heatmap_figure(
+            cfg_path, sort_method, selected_sample_ids=sample_ids
         )
+    except Exception as e:
+        # Exceptions in widget callbacks are only logged, so show the error in the plot
+        fig = create_empty_placeholder_figure(f"Error loading NMF data: {e}")
+    # Settle the widget's own layout settings first; within a batch an edit that
+    # matches the widget's current value is dropped, so reapplying them later
+    # would not override the figure's
+    _configure_widget_layout(fig, sample_ids)
+
+    with heatmap_widget.batch_update():
+        if [t.type for t in heatmap_widget.data] == [t.type for t in fig.data]:
+            for trace, new_trace in zip(heatmap_widget.data, fig.data):
+                props = new_trace.to_plotly_json()
+                props.pop("type")
+                trace.update(props, overwrite=True)
+            heatmap_widget.update_layout(fig.layout.to_plotly_json(), overwrite=True)
+        else:
+            # Switching to or from an error placeholder
+            heatmap_widget.data = ()
+            heatmap_widget.add_traces(fig.data)
+            heatmap_widget.layout = fig.layout
+
+
+def _heatmap_widget(fig: go.Figure, sample_ids=None) -> go.FigureWidget:
+    heatmap_widget = go.FigureWidget(fig)
+    _configure_widget_layout(heatmap_widget, sample_ids)
+    return heatmap_widget
 
-    heatmap_widget.update_layout(
+
+def _configure_widget_layout(fig: go.Figure | go.FigureWidget, sample_ids=None) -> None:
+    fig.update_layout(
         hovermode="closest",  # More precise hover information
-        uirevision="same",  # Preserve UI state between updates
+        # Keep zoom and pan across sort changes, but start afresh when a new
+        # selection changes which samples are shown
+        uirevision=_selection_revision(sample_ids),
     )
 
-    return heatmap_widget
+
+def _selection_revision(sample_ids) -> str:
+    """A uirevision that changes exactly when the set of shown samples does."""
+    if sample_ids is None:
+        return "all"
+    return f"selection-{hash(frozenset(np.asarray(sample_ids).tolist()))}"
 
 
 def create_heatmap_figure(
@@ -34,30 +89,56 @@ def create_heatmap_figure(
     sort_method: str = "component",
     selected_sample_ids: list[int] | None = None,
 ) -> go.Figure:
-    # --- load data ------------------------------------------------------ #
     if selected_sample_ids is None:
-        H, sample_ids_from_file, cancer_types = _get_prepared_data(
-            Path("data/all_H_component_contributions.csv"),
-        )
-    else:
-        H, sample_ids_from_file, cancer_types = _get_prepared_data(
-            Path("data/all_H_component_contributions.csv"),
-            selection=selected_sample_ids,
+        # Hand out a copy so callers can restyle it without touching the cache
+        return go.Figure(
+            _cached_heatmap_figure(str(cfg_path), sort_method, input_mtimes(cfg_path))
         )
+
+    return _build_heatmap_figure(cfg_path, sort_method, selected_sample_ids)
+
+
+@lru_cache(maxsize=8)
+def _cached_heatmap_figure(
+    cfg_path: str, sort_method: str, mtimes: tuple[int, ...]
+) -> go.Figure:
+    """Build the figure for all samples, sorted by ``sort_method``."""
+    return _build_heatmap_figure(cfg_path, sort_method)
+
+
+def _build_heatmap_figure(
+    cfg_path: str | Path,
+    sort_method: str,
+    selected_sample_ids: list[int] | None = None,
+) -> go.Figure:
+    # --- load data ------------------------------------------------------ #
+    H, sample_ids_from_file, cancer_types = get_prepared_data(
+        cfg_path, selection=selected_sample_ids
+    )
     n_samples, n_comps = H.shape
 
     # --- ordering ------------------------------------------------------- #
-    comp_order = np.argsort(-H.sum(axis=0))
-    H_ord = H[:, comp_order]
+    comp_order = get_component_order(H)
+    # The dominant-component strip needs every sample's winner whatever the
+    # sort, so find them once and let the sort reuse them
+    winners = winning_components(H, comp_order)
 
     samp_order_indices = get_sample_order(
-        sort_method, H, sample_ids_from_file, cancer_types, cfg_path
+        sort_method,
+        H,
+        sample_ids_from_file,
+        cancer_types,
+        cfg_path,
+        component_order=comp_order,
+        winners=winners,
     )
 
-    H_sorted = H_ord[samp_order_indices]
-    x_labels = np.array(sample_ids_from_file)[samp_order_indices]
+    # Reorder in a single gather, straight into the component-major layout the
+    # main heatmap draws; everything that walks samples uses the transposed view
+    H_sorted_T = H.T[np.ix_(comp_order, samp_order_indices)]
+    H_sorted = H_sorted_T.T
 
-    x_labels_short = np.array([label[:4] for label in x_labels])
+    x_labels_short = cancer_types[samp_order_indices]
 
     # --- color preparation ---------------------------------------------- #
     cfg = load_cfg(cfg_path)
@@ -70,7 +151,8 @@ def create_heatmap_figure(
     comp_colors = _load_component_colors(component_color_file, n_comps, comp_order)
 
     user_cancer_colors = load_cancer_colors(cfg.get("JSON_FILENAME_CANCER_TYPE_COLORS"))
-    uniq_cancers = sorted(set(cancer_types))
+    # Sorted unique cancer types plus each sample's integer code into them
+    uniq_cancers, cancer_idx = np.unique(cancer_types, return_inverse=True)
     auto_cancer_palette = distinct_palette(len(uniq_cancers))
     cancer_color_map = {
         ct: user_cancer_colors.get(ct, auto_cancer_palette[i])
@@ -78,10 +160,10 @@ def create_heatmap_figure(
     }
 
     organ_system_file = cfg.get("JSON_FILENAME_ORGAN_SYSTEM", "tissue_source_tcga.json")
-    organ_system_data = _load_organ_system_data(organ_system_file)
+    organ_system_data = load_groupings(organ_system_file) or []
 
     embryonic_layer_file = cfg.get("JSON_FILENAME_EMBRYONIC_LAYER", "emb.json")
-    embryonic_layer_data = _load_organ_system_data(embryonic_layer_file)
+    embryonic_layer_data = load_groupings(embryonic_layer_file) or []
 
     cancer_codes = x_labels_short
     organ_systems, organ_system_colors = _map_cancer_codes_to_organ_systems(
@@ -111,7 +193,7 @@ def create_heatmap_figure(
     # 1) Main heatmap - This is the first trace, used for selection
     fig.add_trace(
         go.Heatmap(
-            z=H_sorted.T,
+            z=H_sorted_T,
             colorscale="Turbo",
             colorbar=dict(title="Activity", x=1.02),
             showscale=False,
@@ -125,13 +207,19 @@ def create_heatmap_figure(
     _add_proportional_bar_chart(fig, H_sorted, comp_colors, comp_order)
 
     # 3) Component strip with legend
-    _add_component_strip(
-        fig, H_ord, samp_order_indices, comp_colors, n_comps, comp_order
-    )
+    # Winners are reported as positions in comp_order, with ties (e.g. all-zero
+    # samples) going to the earlier component as argmax over H_sorted would,
+    # and then put in sample order
+    winning_comp_indices = winners[0][samp_order_indices]
+    _add_component_strip(fig, winning_comp_indices, comp_colors, n_comps, comp_order)
 
     # 4) Cancer type strip with legend
     _add_cancer_strip_with_legend(
-        fig, cancer_types, samp_order_indices, uniq_cancers, cancer_color_map
+        fig,
+        x_labels_short,
+        cancer_idx[samp_order_indices],
+        uniq_cancers,
+        cancer_color_map,
     )
 
     # 5) Organ system strip with legend
@@ -150,7 +238,6 @@ def create_heatmap_figure(
         n_comps,
         n_samples,
         comp_order,
-        x_labels,
         x_labels_short,
         n_annotation_strips=2,
     )
@@ -158,17 +245,6 @@ def create_heatmap_figure(
     return fig
 
 
-def _load_organ_system_data(json_filename: str) -> dict:
-    """Load organ system or embryonic layer groupings from JSON file."""
-    try:
-        with open(json_filename, "r") as f:
-            data = json.load(f)
-        return data["organ_system_groupings"]
-    except Exception as e:
-        # print(f"Error loading grouping data from {json_filename}: {e}")
-        return {}
-
-
 def _map_cancer_codes_to_organ_systems(cancer_codes, grouping_data):
     """Map cancer codes to their groups and colors."""
     code_to_group = {}
@@ -182,63 +258,57 @@ def _map_cancer_codes_to_organ_systems(cancer_codes, grouping_data):
             code_to_group[short_code] = group_name
             code_to_color[short_code] = color
 
-    groups = []
-    group_colors = []
+    # Look up each distinct code once, then broadcast back to every sample
+    uniq_codes, code_idx = np.unique(np.asarray(cancer_codes), return_inverse=True)
+    uniq_codes = uniq_codes.tolist()
+    groups = np.array([code_to_group.get(c, "Unknown") for c in uniq_codes], object)
+    colors = np.array([code_to_color.get(c, "#CCCCCC") for c in uniq_codes], object)
 
-    for code in cancer_codes:
-        groups.append(code_to_group.get(code, "Unknown"))
-        group_colors.append(code_to_color.get(code, "#CCCCCC"))  # Gray for unknown
-
-    return groups, group_colors
+    return groups[code_idx], colors[code_idx]
 
 
 def _load_component_colors(
     json_filename: str, n_comps: int, comp_order: np.ndarray
 ) -> list:
     """Load component colors from JSON file or generate fallback colors."""
-    if json_filename:
-        with open(json_filename, "r") as f:
-            color_map = json.load(f)
+    return list(
+        _resolve_component_colors(
+            json_filename,
+            mtime_ns(json_filename),
+            n_comps,
+            tuple(comp_order.tolist()),
+        )
+    )
 
-        ordered_colors = []
-        auto_colors = component_palette(n_comps)
 
-        component_color_mapping = {}
+@lru_cache(maxsize=8)
+def _resolve_component_colors(
+    json_filename: str, mtime: int, n_comps: int, comp_order: tuple[int, ...]
+) -> tuple[str, ...]:
+    """Return the component colors in ``comp_order``."""
+    if json_filename:
+        color_map = read_json(json_filename)
 
-        for i in comp_order:
-            comp_name = f"Comp_{i}"
-            alt_name1 = f"Component {i + 1}"
-            alt_name2 = f"Comp {i + 1}"
-            alt_name3 = str(i + 1)
+        # Color files spell component keys several ways; resolve each index once,
+        # preferring "Comp_<i>"
+        colors_by_index = {}
+        for i in range(n_comps):
+            for key in (f"Comp_{i}", f"Component {i + 1}", f"Comp {i + 1}", str(i + 1)):
+                if color_map.get(key):
+                    colors_by_index[i] = color_map[key]
+                    break
 
-            color = (
-                color_map.get(comp_name)
-                or color_map.get(alt_name1)
-                or color_map.get(alt_name2)
-                or color_map.get(alt_name3)
-            )
+        if len(colors_by_index) == n_comps:
+            return tuple(colors_by_index[i] for i in comp_order)
 
-            if color:
-                ordered_colors.append(color)
-                matched_key = next(
-                    k
-                    for k in [comp_name, alt_name1, alt_name2, alt_name3]
-                    if k in color_map and color_map[k] == color
-                )
-                component_color_mapping[f"Component {i + 1}"] = {
-                    "color": color,
-                    "matched_key": matched_key,
-                }
-            else:
-                fallback_color = auto_colors[len(ordered_colors) % len(auto_colors)]
-                ordered_colors.append(fallback_color)
-                component_color_mapping[f"Component {i + 1}"] = {
-                    "color": fallback_color,
-                    "fallback": True,
-                }
-        return ordered_colors
-
-    return component_palette(n_comps)
+        # Only sample the fallback palette when some component has no color
+        auto_colors = component_palette(n_comps)
+        return tuple(
+            colors_by_index.get(i, auto_colors[j % len(auto_colors)])
+            for j, i in enumerate(comp_order)
+        )
+
+    return tuple(component_palette(n_comps))
 
 
 def _add_proportional_bar_chart(
@@ -250,25 +320,32 @@ def _add_proportional_bar_chart(
 ) -> None:
     _, _ = H_sorted.shape
 
-    H_proportional = H_sorted / H_sorted.sum(axis=1, keepdims=True)
+    # One reciprocal per sample, then a multiply per cell instead of a divide.
+    # Samples with no activity keep a scale of 0 so their bars are empty, not NaN.
+    row_scale = H_sorted.sum(axis=1)
+    np.reciprocal(row_scale, out=row_scale, where=row_scale > 0)
+    # Written component-major so each bar trace gets a contiguous row
+    H_proportional = np.multiply(H_sorted.T, row_scale, order="C")
 
+    bars = []
     for i, comp_idx in enumerate(comp_order):
         color = comp_colors[i]
 
         comp_name = f"Comp {comp_idx + 1}"
         hover_template = f"Sample: %{{x}}<br>Component: {comp_name}<br>Proportion: %{{y:.2f}}<extra></extra>"
 
-        fig.add_trace(
+        bars.append(
             go.Bar(
-                y=H_proportional[:, i],
+                y=H_proportional[i],
                 name=comp_name,
                 marker_color=color,
                 hovertemplate=hover_template,
-            ),
-            row=2,
-            col=1,
+            )
         )
 
+    # A single add_traces call validates and lays out all the bars at once
+    fig.add_traces(bars, rows=2, cols=1)
+
     fig.update_layout(
         barmode="stack",
         showlegend=show_legend,
@@ -278,36 +355,44 @@ def _add_proportional_bar_chart(
     fig.update_yaxes(title="Proportion", range=[0, 1], row=2, col=1)
 
 
+def _strip_z(codes, n_codes: int) -> np.ndarray:
+    """Shape category codes as a one-row heatmap in the narrowest integer dtype."""
+    # plotly ships 2-D numpy arrays to the browser as binary typed arrays, so a
+    # narrow dtype directly shrinks the payload; nested lists go out as JSON
+    dtype = np.min_scalar_type(max(n_codes - 1, 0))
+    return np.asarray(codes, dtype=dtype)[np.newaxis]
+
+
+def _category_colorscale(colors: list) -> dict:
+    """Heatmap colorscale arguments giving each code 0..n-1 its own solid band."""
+    edges = np.linspace(0, 1, len(colors) + 1).tolist()
+    return dict(
+        colorscale=[
+            (edge, color)
+            for i, color in enumerate(colors)
+            for edge in (edges[i], edges[i + 1])
+        ],
+        # Fix the z range so codes absent from a selection don't shift the bands
+        zmin=-0.5,
+        zmax=len(colors) - 0.5,
+    )
+
+
 def _add_component_strip(
     fig: go.Figure,
-    H_ord: np.ndarray,
-    samp_order: np.ndarray,
+    winning_comp_indices: np.ndarray,
     comp_colors: list,
     n_comps: int,
     comp_order: np.ndarray,
     show_legend: bool = False,
 ) -> None:
     """Add component strip with interactive legend."""
-    winning_comp_indices = np.argmax(H_ord[samp_order], axis=1)
-    winning_comp_numbers = np.array([comp_order[i] + 1 for i in winning_comp_indices])
-
-    idx_to_color = {i: comp_colors[i] for i in range(n_comps)}
-
-    comp_scale = []
-    for i in range(n_comps):
-        if i == 0:
-            comp_scale.append((0, idx_to_color[i]))
-        else:
-            comp_scale.append(((i - 0.5) / (n_comps - 1), idx_to_color[i - 1]))
-            comp_scale.append(((i) / (n_comps - 1), idx_to_color[i]))
-
-    if n_comps > 1:
-        comp_scale.append((1, idx_to_color[n_comps - 1]))
+    winning_comp_numbers = comp_order[winning_comp_indices] + 1
 
     fig.add_trace(
         go.Heatmap(
-            z=[winning_comp_indices],
-            colorscale=comp_scale,
+            z=_strip_z(winning_comp_indices, n_comps),
+            **_category_colorscale(comp_colors),
             showscale=False,
             hovertemplate="Sample: %{x}<br>Dominant Component: Comp %{customdata}<extra></extra>",
             customdata=[winning_comp_numbers],
@@ -320,33 +405,21 @@ def _add_component_strip(
 
 def _add_cancer_strip_with_legend(
     fig: go.Figure,
-    cancer_types: list,
-    samp_order: np.ndarray,
+    cancer_types_sorted: np.ndarray,
+    cancer_idx_sorted: np.ndarray,
     uniq_cancers: list,
     cancer_color_map: dict,
 ) -> None:
     """Add cancer type strip with interactive legend."""
-    cancer_to_idx = {ct: i for i, ct in enumerate(uniq_cancers)}
-    cancer_idx_arr = [cancer_to_idx[ct] for ct in np.array(cancer_types)[samp_order]]
-
-    if len(uniq_cancers) == 1:
-        cancer_scale = [
-            (0, cancer_color_map[uniq_cancers[0]]),
-            (1, cancer_color_map[uniq_cancers[0]]),
-        ]
-    else:
-        cancer_scale = [
-            (i / (len(uniq_cancers) - 1), cancer_color_map[ct])
-            for i, ct in enumerate(uniq_cancers)
-        ]
+    cancer_colors = [cancer_color_map[ct] for ct in uniq_cancers]
 
     fig.add_trace(
         go.Heatmap(
-            z=[cancer_idx_arr],
-            colorscale=cancer_scale,
+            z=_strip_z(cancer_idx_sorted, len(uniq_cancers)),
+            **_category_colorscale(cancer_colors),
             showscale=False,
             hovertemplate="Sample: %{x}<br>Cancer Type: %{customdata}<extra></extra>",
-            customdata=[np.array(cancer_types)[samp_order]],
+            customdata=[cancer_types_sorted],
             showlegend=False,
         ),
         row=4,
@@ -363,32 +436,18 @@ def _add_annotation_strip_with_legend(
     col: int,
 ) -> None:
     """Add annotation strip (organ system/embryonic layer) with interactive legend."""
-    unique_groups = sorted(list(set(group_names)))
-    group_to_idx = {group: i for i, group in enumerate(unique_groups)}
-
-    group_idx_arr = [group_to_idx[group] for group in group_names]
-
-    unique_colors = {}
-    for group_name, color in zip(group_names, group_colors):
-        if group_name not in unique_colors:
-            unique_colors[group_name] = color
-
+    # Sorted groups, where each first appears (for its color), and every
+    # sample's index into the sorted groups
+    unique_groups, first_idx, group_idx_arr = np.unique(
+        group_names, return_index=True, return_inverse=True
+    )
+    unique_colors = np.asarray(group_colors)[first_idx].tolist()
     n_groups = len(unique_groups)
-    if n_groups == 1:
-        group_scale = [
-            (0, unique_colors[unique_groups[0]]),
-            (1, unique_colors[unique_groups[0]]),
-        ]
-    else:
-        group_scale = [
-            (i / (n_groups - 1), unique_colors[ug])
-            for i, ug in enumerate(unique_groups)
-        ]
 
     fig.add_trace(
         go.Heatmap(
-            z=[group_idx_arr],
-            colorscale=group_scale,
+            z=_strip_z(group_idx_arr, n_groups),
+            **_category_colorscale(unique_colors),
             showscale=False,
             hovertemplate=f"Sample: %{{x}}<br>{label}: %{{customdata}}<extra></extra>",
             customdata=[group_names],
@@ -404,7 +463,6 @@ def _configure_layout(
     n_comps: int,
     n_samples: int,
     comp_order: np.ndarray,
-    _: np.ndarray,
     x_labels_short: np.ndarray,
     n_annotation_strips: int = 2,
 ) -> None:
@@ -440,12 +498,13 @@ def _configure_layout(
         "Embryonic Layer": {"y": 1.22, "x": 0.8, "title": "Embryonic Layer"},
     }
 
+    legend_ids = {name: f"legend{i + 1}" for i, name in enumerate(legend_groups_info)}
     legend_config = {}
 
-    for _, trace in enumerate(fig.data):
-        if trace.legendgroup in legend_groups_info:
+    for trace in fig.data:
+        if trace.legendgroup in legend_ids:
             group_name = trace.legendgroup
-            legend_id = f"legend{list(legend_groups_info.keys()).index(group_name) + 1}"
+            legend_id = legend_ids[group_name]
             trace.legend = legend_id
 
             if legend_id not in legend_config:
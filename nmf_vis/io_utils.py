@@ -0,0 +1,70 @@
+from __future__ import annotations
+import json
+import os
+import warnings
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+
+def mtime_ns(path: str | Path | None) -> int:
+    """Return a file's modification time in ns, or -1 if it is unset or missing.
+
+    lru-cached loaders take this as an extra argument that only keys the cache,
+    so that editing a file invalidates whatever was built from it.
+    """
+    if not path:
+        return -1
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+@lru_cache(maxsize=32)
+def _read_json_cached(path: str, mtime: int) -> Any:
+    """Parse a JSON file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_json(path: str | Path) -> Any:
+    """Parse a JSON file, reusing the result until the file's mtime changes."""
+    p = Path(path).resolve()
+    return _read_json_cached(str(p), os.stat(p).st_mtime_ns)
+
+
+def cancer_codes(sample_ids) -> np.ndarray:
+    """Return the 4-character cancer code prefix of each sample ID."""
+    # Casting to a narrower unicode dtype truncates every string in one C loop
+    return np.asarray(sample_ids, dtype=np.str_).astype("<U4")
+
+
+def load_groupings(path: str | Path | None) -> list[dict] | None:
+    """Load the groups of an organ-system or embryonic-layer JSON file.
+
+    Returns None, with a warning, if the file is missing or malformed.
+    """
+    try:
+        # Copy out just the fields the views read, so that a malformed file
+        # fails here rather than halfway through a sort or a figure
+        groupings = []
+        for group in read_json(path)["organ_system_groupings"]:
+            codes = group["cancer_codes"]
+            if not isinstance(codes, list):
+                raise TypeError(
+                    f"cancer_codes of {group['group_name']!r} is not a list"
+                )
+            groupings.append(
+                {
+                    "group_name": group["group_name"],
+                    "color": group["color"],
+                    "cancer_codes": list(codes),
+                }
+            )
+        return groupings
+    except (OSError, KeyError, TypeError, json.JSONDecodeError) as e:
+        warnings.warn(f"Error loading groupings from {path}: {e}", stacklevel=2)
+        return None
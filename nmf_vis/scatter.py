@@ -11,14 +11,13 @@ def create_umap_visualization(
 ):
     """Creates a UMAP visualization of the NMF components using jscatter."""
     # Ensure all cancer types have colors
-    unique_cancer_types = sorted(list(set(cancer_types)))
+    unique_cancer_types = np.unique(cancer_types)
     if not all(ct in cancer_color_map for ct in unique_cancer_types):
-        color_palette = sns.color_palette("turbo", len(unique_cancer_types))
-        # Convert RGB tuples to hex colors
-        color_palette = [
-            f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}"
-            for r, g, b in color_palette
-        ]
+        # Scale and truncate the whole palette to 8-bit RGB at once, then hex-format
+        rgb = (
+            np.asarray(sns.color_palette("turbo", len(unique_cancer_types))) * 255
+        ).astype(np.uint8)
+        color_palette = ["#%02x%02x%02x" % tuple(row) for row in rgb.tolist()]
         missing_types = [ct for ct in unique_cancer_types if ct not in cancer_color_map]
         for i, ct in enumerate(missing_types):
             cancer_color_map[ct] = color_palette[i % len(color_palette)]
@@ -50,9 +49,6 @@ def create_umap_visualization(
         }
     )
 
-    # Make sure to add sample_ids to the DataFrame
-    umap_df["Sample ID"] = sample_ids
-
     return scatter_plot, umap_df
 
 
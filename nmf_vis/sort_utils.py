@@ -1,17 +1,127 @@
+from functools import lru_cache
+
 import numpy as np
-import json
 
+from nmf_vis.io_utils import cancer_codes, load_groupings, mtime_ns, read_json
+
+# Below this many samples numpy is already fast and JIT compilation isn't worth it
+JIT_MIN_SAMPLES = 10_000
 
-def bar_sort_order(mat: np.ndarray) -> np.ndarray:
-    """Return indices that order samples by winning component, then activity."""
-    winners = np.argmax(mat, axis=1)
-    order = []
-    for comp in range(mat.shape[1]):
-        # Get samples sorted by activity for the current component
-        idx = np.argsort(-mat[:, comp])
-        # Filter this list, keeping only samples whose "winner" is the current component
-        order.extend(idx[winners[idx] == comp])
-    return np.asarray(order, dtype=int)
+
+@lru_cache(maxsize=None)
+def _row_argmax_jit():
+    """Build the numba row-argmax kernel on first use; None without numba.
+
+    numba is only imported here so loading data for small matrices doesn't pay
+    for it.
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:  # numba is optional; numpy handles the same work
+        return None
+
+    @njit(parallel=True, cache=True)
+    def row_argmax(mat, order):
+        # Scans each row's columns in ``order`` and, like np.argmax, keeps the
+        # first of tied maxima and stops at the first NaN
+        n_samples, n_components = mat.shape
+        winners = np.empty(n_samples, np.intp)
+        max_vals = np.empty(n_samples, mat.dtype)
+        for i in prange(n_samples):
+            best = 0
+            best_val = mat[i, order[0]]
+            if not np.isnan(best_val):
+                for j in range(1, n_components):
+                    val = mat[i, order[j]]
+                    if np.isnan(val):
+                        best_val = val
+                        best = j
+                        break
+                    if val > best_val:
+                        best_val = val
+                        best = j
+            winners[i] = best
+            max_vals[i] = best_val
+        return winners, max_vals
+
+    return row_argmax
+
+
+def get_component_order(H: np.ndarray) -> np.ndarray:
+    """Order components by total activity across samples, highest first."""
+    # Every component is drawn, so this is a full sort rather than a top-k
+    # partition. Sorting the negated sums (rather than reversing an ascending
+    # sort) keeps tied components in column order.
+    return np.argsort(-H.sum(axis=0), kind="stable")
+
+
+def winning_components(
+    mat: np.ndarray, component_order: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return each sample's winning component and its activity.
+
+    With ``component_order``, winners are reported as positions in that order
+    and ties (including all-zero rows) go to the component that comes first in
+    it, exactly as argmax on ``mat[:, component_order]``.
+    """
+    kernel = (
+        _row_argmax_jit()
+        if mat.shape[0] >= JIT_MIN_SAMPLES and mat.shape[1] > 0
+        else None
+    )
+    if kernel is not None:
+        if component_order is None:
+            component_order = np.arange(mat.shape[1])
+        # One parallel pass finds both the winner and its value for each row
+        return kernel(mat, component_order)
+
+    if component_order is None:
+        winners = np.argmax(mat, axis=1)
+        return winners, mat[np.arange(mat.shape[0]), winners]
+
+    # Scan the columns in component_order, one strided view at a time, instead
+    # of argmax over a reordered copy of mat. As with argmax, a strictly greater
+    # value is needed to take over, so the first of tied maxima wins, and the
+    # first NaN wins outright.
+    winners = np.zeros(mat.shape[0], np.intp)
+    max_vals = mat[:, component_order[0]].copy()
+    for pos in range(1, component_order.size):
+        col = mat[:, component_order[pos]]
+        better = (col > max_vals) | (np.isnan(col) & ~np.isnan(max_vals))
+        winners[better] = pos
+        max_vals[better] = col[better]
+    return winners, max_vals
+
+
+def bar_sort_order(
+    mat: np.ndarray,
+    component_order: np.ndarray | None = None,
+    winners: tuple[np.ndarray, np.ndarray] | None = None,
+) -> np.ndarray:
+    """Return indices that order samples by winning component, then activity.
+
+    ``winners`` can pass in ``winning_components(mat, component_order)`` when the
+    caller has already computed it.
+    """
+    if winners is None:
+        winners = winning_components(mat, component_order)
+    winners, max_vals = winners
+    # lexsort treats the last key as primary: group by winner, then by descending activity
+    return np.lexsort((-max_vals, winners))
+
+
+def grouped_bar_sort_order(
+    mat: np.ndarray,
+    groups,
+    component_order: np.ndarray | None = None,
+    winners: tuple[np.ndarray, np.ndarray] | None = None,
+) -> np.ndarray:
+    """Return indices that order samples by group, then as in bar_sort_order."""
+    _, group_idx = np.unique(np.asarray(groups), return_inverse=True)
+    if winners is None:
+        winners = winning_components(mat, component_order)
+    winners, max_vals = winners
+    return np.lexsort((-max_vals, winners, group_idx))
 
 
 def get_alphabetical_sort(sample_ids: list) -> np.ndarray:
@@ -19,96 +129,70 @@ def get_alphabetical_sort(sample_ids: list) -> np.ndarray:
     return np.argsort(sample_ids)
 
 
-def get_cancer_type_sort(H: np.ndarray, cancer_types: list) -> np.ndarray:
+def get_cancer_type_sort(
+    H: np.ndarray,
+    cancer_types: list,
+    component_order: np.ndarray,
+    winners: tuple[np.ndarray, np.ndarray] | None = None,
+) -> np.ndarray:
     """Correctly sort by cancer type, then by component within each type."""
-    final_order = []
-    # Pre-sort component columns by total activity for consistent sub-sorting
-    comp_order = np.argsort(-H.sum(axis=0))
-    H_ord = H[:, comp_order]
-
-    # Get a sorted list of unique cancer types for the primary sort order
-    unique_cancers = sorted(list(set(cancer_types)))
-
-    for cancer in unique_cancers:
-        # Find original indices for all samples of the current cancer type
-        sub_indices = np.where(np.array(cancer_types) == cancer)[0]
-
-        if len(sub_indices) == 0:
-            continue
+    return grouped_bar_sort_order(H, cancer_types, component_order, winners)
 
-        # Get the subset of the H matrix for these samples
-        H_subset = H_ord[sub_indices, :]
 
-        # Sort these samples by component. sub_order has indices relative to the subset.
-        sub_order = bar_sort_order(H_subset)
-
-        # Map these relative indices back to the original indices and add to the final list
-        final_order.extend(sub_indices[sub_order])
-
-    return np.array(final_order, dtype=int)
+@lru_cache(maxsize=8)
+def _load_code_to_organ(organ_system_file: str, mtime: int) -> dict[str, str] | None:
+    """Map cancer codes to organ systems; None if the grouping file is unusable."""
+    groupings = load_groupings(organ_system_file)
+    if groupings is None:
+        return None
+    return {
+        code: group["group_name"]
+        for group in groupings
+        for code in group["cancer_codes"]
+    }
 
 
 def get_organ_system_sort(
-    H: np.ndarray, cancer_types: list, sample_ids: list, config_path: str
+    H: np.ndarray,
+    cancer_types: list,
+    sample_ids: list,
+    config_path: str,
+    component_order: np.ndarray,
+    winners: tuple[np.ndarray, np.ndarray] | None = None,
 ) -> np.ndarray:
     """Correctly sort by organ system, then by component within each group."""
-    from nmf_vis.data_utils import load_cfg
-
-    try:
-        cfg = load_cfg(config_path)
-        # It's safer to use the sample_ids to map to cancer codes than the full cancer_types string
-        cancer_codes = [sid[:4] for sid in sample_ids]
-
-        # Load organ system data from the correct JSON file specified in config
-        organ_system_file = cfg.get(
-            "JSON_FILENAME_ORGAN_SYSTEM", "tissue_source_tcga.json"
-        )
-        with open(organ_system_file, "r") as f:
-            grouping_data = json.load(f).get("organ_system_groupings", [])
-
-        # Map cancer codes to organ systems
-        code_to_organ = {}
-        for group in grouping_data:
-            for code in group["cancer_codes"]:
-                code_to_organ[code] = group["group_name"]
-
-        # Get organ system for each sample, defaulting to "Unknown"
-        organ_systems = [code_to_organ.get(code, "Unknown") for code in cancer_codes]
-
-        # --- This part now mirrors the corrected cancer_type_sort logic ---
-        final_order = []
-        comp_order = np.argsort(-H.sum(axis=0))
-        H_ord = H[:, comp_order]
+    cfg = read_json(config_path)
 
-        unique_organs = sorted(list(set(organ_systems)))
+    # Load organ system data from the correct JSON file specified in config
+    organ_system_file = cfg.get("JSON_FILENAME_ORGAN_SYSTEM", "tissue_source_tcga.json")
+    code_to_organ = _load_code_to_organ(organ_system_file, mtime_ns(organ_system_file))
+    if code_to_organ is None:
+        # Fall back to component sort
+        return bar_sort_order(H, component_order, winners)
 
-        for organ in unique_organs:
-            sub_indices = np.where(np.array(organ_systems) == organ)[0]
+    # It's safer to use the sample_ids to map to cancer codes than the full cancer_types string
+    codes = cancer_codes(sample_ids)
 
-            if len(sub_indices) == 0:
-                continue
+    # Look up the organ system of each distinct code, defaulting to "Unknown",
+    # and rank the systems so samples are grouped by integer code, not string
+    uniq_codes, code_idx = np.unique(codes, return_inverse=True)
+    organ_systems = [code_to_organ.get(code, "Unknown") for code in uniq_codes.tolist()]
+    _, organ_rank = np.unique(organ_systems, return_inverse=True)
 
-            H_subset = H_ord[sub_indices, :]
-            sub_order = bar_sort_order(H_subset)
-            final_order.extend(sub_indices[sub_order])
-
-        return np.array(final_order, dtype=int)
-
-    except Exception as e:
-        # print(f"Error in organ system sorting: {e}. Falling back to component sort.")
-        comp_order = np.argsort(-H.sum(axis=0))
-        H_ord = H[:, comp_order]
-        return bar_sort_order(H_ord)
+    # --- This part now mirrors the corrected cancer_type_sort logic ---
+    return grouped_bar_sort_order(H, organ_rank[code_idx], component_order, winners)
 
 
 def get_embryonic_layer_sort(
-    H: np.ndarray, cancer_types: list, config_path: str
+    H: np.ndarray,
+    cancer_types: list,
+    config_path: str,
+    component_order: np.ndarray,
+    winners: tuple[np.ndarray, np.ndarray] | None = None,
 ) -> np.ndarray:
     """Sort by embryonic layer, then by component within each layer."""
     # Fall back to component sorting for now
-    comp_order = np.argsort(-H.sum(axis=0))
-    H_ord = H[:, comp_order]
-    return bar_sort_order(H_ord)
+    return bar_sort_order(H, component_order, winners)
 
 
 def get_sample_order(
@@ -117,28 +201,39 @@ def get_sample_order(
     sample_ids: list,
     cancer_types: list,
     config_path: str,
+    component_order: np.ndarray | None = None,
+    winners: tuple[np.ndarray, np.ndarray] | None = None,
 ) -> np.ndarray:
-    """Get sample ordering indices based on different sorting methods."""
+    """Get sample ordering indices based on different sorting methods.
+
+    Callers that already ordered components by total activity, or found each
+    sample's winner with ``winning_components(H, component_order)``, can pass
+    ``component_order`` and ``winners`` to avoid recomputing them.
+    """
 
     # Always pre-sort components for consistent sub-sorting
-    comp_order = np.argsort(-H.sum(axis=0))
-    H_ord = H[:, comp_order]
+    if component_order is None:
+        component_order = get_component_order(H)
 
     if sort_method == "component":
-        return bar_sort_order(H_ord)
+        return bar_sort_order(H, component_order, winners)
 
     elif sort_method == "alphabetical":
         return get_alphabetical_sort(sample_ids)
 
     elif sort_method == "cancer_type":
-        return get_cancer_type_sort(H, cancer_types)
+        return get_cancer_type_sort(H, cancer_types, component_order, winners)
 
     elif sort_method == "organ_system":
         # Pass sample_ids to organ sort to reliably get cancer codes
-        return get_organ_system_sort(H, cancer_types, sample_ids, config_path)
+        return get_organ_system_sort(
+            H, cancer_types, sample_ids, config_path, component_order, winners
+        )
 
     elif sort_method == "embryonic_layer":
-        return get_embryonic_layer_sort(H, cancer_types, config_path)
+        return get_embryonic_layer_sort(
+            H, cancer_types, config_path, component_order, winners
+        )
 
     # Default to component sorting if method not recognized
-    return bar_sort_order(H_ord)
+    return bar_sort_order(H, component_order, winners)